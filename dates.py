@@ -0,0 +1,14 @@
+from datetime import datetime
+
+
+def parse_ymd(s: str) -> datetime:
+    """Parse a date of the form YYYY-MM-DD. Slicing out the fields is much cheaper than datetime.strptime, so that's
+    done for well-formed dates; anything else goes through strptime, so it's accepted or rejected exactly as before."""
+    if len(s) == 10 and s[4] == s[7] == "-" and s[0:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit():
+        try:
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+        except ValueError:
+            # e.g. 2021-02-30, which strptime will reject with its usual message
+            pass
+
+    return datetime.strptime(s, "%Y-%m-%d")
@@ -1,6 +1,7 @@
+import csv
+import io
 import re
-from collections.abc import Iterator
-from csv import DictWriter
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
@@ -9,6 +10,11 @@ from zipfile import ZipFile
 
 from argvns import argvns, Arg
 
+from dates import parse_ymd
+
+_TAG_STRIP = re.compile(r"\s*\[.*?]\s*")
+_TAG_FIND = re.compile(r"\[.*?]")
+
 
 @dataclass
 class ScriptData:
@@ -21,12 +27,12 @@ class ScriptData:
     summary: str
 
     @classmethod
-    def from_scriptbin_export(cls, content: str) -> Self:
-        lines = iter(content.split("\r\n"))
+    def from_scriptbin_export(cls, lines: Iterable[str]) -> Self:
+        lines = (line.rstrip("\r\n") for line in lines)
 
         title_and_tags = next(lines)
-        title = re.sub(r"\s*\[.*?]\s*", "", title_and_tags)
-        tags = re.findall(r"\[.*?]", title_and_tags)
+        title = _TAG_STRIP.sub("", title_and_tags)
+        tags = _TAG_FIND.findall(title_and_tags)
 
         next(lines)  # divider line: ####
         next(lines)  # empty line
@@ -39,13 +45,13 @@ class ScriptData:
 
         # Created: 1970-01-01 00:00:00 UTC
         created_dt_str = next(lines).split()[1]
-        created_dt = datetime.strptime(created_dt_str, "%Y-%m-%d")
+        created_dt = parse_ymd(created_dt_str)
 
         # Updated: 1970-01-01 00:00:00 UTC
         updated = next(lines)
         if updated.startswith("Updated:"):
             updated_dt_str = updated.split()[1]
-            updated_dt = datetime.strptime(updated_dt_str, "%Y-%m-%d")
+            updated_dt = parse_ymd(updated_dt_str)
 
             summary_line = next(lines)
         else:
@@ -60,8 +66,9 @@ class ScriptData:
 
 def read_all_scriptbin_exports(z: ZipFile) -> Iterator[ScriptData]:
     for file in z.infolist():
-        with z.open(file) as f:
-            yield ScriptData.from_scriptbin_export(f.read().decode())
+        # only the header lines are needed, so read them lazily rather than decoding the whole script
+        with z.open(file) as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="\r\n") as f:
+            yield ScriptData.from_scriptbin_export(f)
 
 
 @argvns
@@ -76,14 +83,14 @@ def main():
     config = Config()
 
     with ZipFile(config.infile) as z, open(config.export, "w", encoding="utf-8") as out:
-        writer = DictWriter(out, fieldnames=["Date", "Title"])
-        writer.writeheader()
+        writer = csv.writer(out)
+        writer.writerow(["Date", "Title"])
 
         for s in read_all_scriptbin_exports(z):
             if not s.is_public:
                 continue
 
-            writer.writerow({"Date": (s.updated or s.created).strftime("%Y-%m-%d"), "Title": s.title})
+            writer.writerow([(s.updated or s.created).strftime("%Y-%m-%d"), s.title])
 
 
 if __name__ == "__main__":
@@ -1,107 +1,184 @@
 from __future__ import annotations
 
 import csv
-from bisect import bisect
+from argparse import ArgumentTypeError
 from collections.abc import Container
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Iterable, Iterator
 
 import beaupy
 import colorama
+import numpy as np
 from argvns import argvns, Arg
 from loguru import logger
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 
+from dates import parse_ymd
 from yt import YouTubeClient, VideoData, alert_if_exceeded_quota
 
 # Windows compatibility
 colorama.init()
 
+# a title scoring at least this highly is treated as conclusive, and the description isn't scored
+TITLE_SCORE_CEILING = 95
 
-def colour_similarity(similarity: int, thresholds: tuple[int, int] = (50, 80)) -> str:
-    i = bisect(thresholds, similarity)
-    colour = ["red", "yellow", "green"][i]
 
-    return f"[{colour}]{similarity:03d}[/{colour}]"
+# similarities are integers in [0, 100], so the markup for every possible score can be built once up front:
+# red below 50, yellow below 80, green otherwise
+_SIMILARITY_MARKUP = tuple(
+    f"[{colour}]{similarity:03d}[/{colour}]"
+    for similarity, colour in enumerate(["red"] * 50 + ["yellow"] * 30 + ["green"] * 21)
+)
 
 
-@dataclass
+def colour_similarity(similarity: int) -> str:
+    return _SIMILARITY_MARKUP[similarity]
+
+
+@dataclass(slots=True)
 class SearchResult:
     video: VideoData
     query: str
     similarity: int
 
     def __str__(self):
-        display_components = [
-            colour_similarity(self.similarity),
-            self.video.uploaded.strftime("%Y-%m-%d"),
-            self.video.url,
-            self.video.title,
-            self.video.channel,
-        ]
-        return " :: ".join(display_components)
+        video = self.video
+        return (f"{colour_similarity(self.similarity)} :: {video.uploaded_str} :: {video.url} :: {video.title}"
+                f" :: {video.channel}")
+
+
+@lru_cache(maxsize=4096)
+def _normalise(text: str) -> str:
+    """Normalise text for fuzzy matching. This is cached, since the same video often turns up for several queries."""
+    return default_process(text)
 
 
-def get_ids_from_playlist(client: YouTubeClient, *, playlist_id: str) -> set[str]:
+def get_ids_from_playlist(client: YouTubeClient, *, playlist_id: str) -> frozenset[str]:
     """Get a set of video IDs from the given playlist."""
     with alert_if_exceeded_quota():
-        return set(video.id for video in client.videos_in_playlist(playlist_id))
+        return frozenset(client.video_ids_in_playlist(playlist_id))
 
 
 def search(client: YouTubeClient, search_string: str, number: int, *, ignore_uploaders: Container[str],
-           ignore_ids: Container[str], ignore_before: datetime | None) -> Iterator[SearchResult]:
-    """Perform a search for the given string, and return the given number of results."""
+           ignore_ids: Container[str], ignore_before: datetime | None,
+           min_similarity: int = 0) -> Iterator[SearchResult]:
+    """Perform a search for the given string, and return the given number of results.
+    Results scoring below min_similarity are dropped."""
+    # normalise the query once up front, not once per comparison
+    processed_query = _normalise(search_string)
+
+    prepare = _normalise
+    if not processed_query:
+        # a query made only of symbols or emoji normalises to nothing, which would "match" any empty text perfectly,
+        # so compare the raw text instead
+        processed_query, prepare = search_string, str
+
+    if not processed_query:
+        # nothing to match against, so don't spend any quota searching for it
+        return
+
     with alert_if_exceeded_quota():
-        for result in client.search(query=search_string, max_results=number, after=ignore_before):
-            if result.channel in ignore_uploaders:
-                continue
+        videos = list(client.search(query=search_string, max_results=number, after=ignore_before,
+                                    exclude_ids=ignore_ids, exclude_channels=ignore_uploaders))
 
-            if result.id in ignore_ids:
-                continue
+    if not videos:
+        return
 
-            similarity = max(
-                fuzz.partial_ratio(result.title, search_string),
-                fuzz.partial_ratio(result.description, search_string),
-            )
+    # the cutoff is checked against the unrounded score, so let through anything that rounds up to min_similarity
+    # (rapidfuzz only accepts cutoffs in [0, 100]; past 100 nothing can reach min_similarity anyway)
+    score_cutoff = min(100, max(0, min_similarity - 0.5))
 
-            yield SearchResult(video=result, query=search_string, similarity=similarity)
+    titles = [prepare(video.title) for video in videos]
+    similarities = np.zeros(len(videos), dtype=np.uint8)
+
+    # partial_ratio is always 100 when one string contains the other, so those titles need no scoring at all
+    unmatched = []
+    for i, title in enumerate(titles):
+        if title and (processed_query in title or title in processed_query):
+            similarities[i] = 100
+        else:
+            unmatched.append(i)
+
+    # score everything else against the query in one vectorised call each, rather than one pair at a time;
+    # anything that can't reach the cutoff is abandoned early and scored as 0
+    if unmatched:
+        similarities[unmatched] = process.cdist([processed_query], [titles[i] for i in unmatched],
+                                                scorer=fuzz.partial_ratio, dtype=np.uint8, score_cutoff=score_cutoff)[0]
+
+    # descriptions are far longer than titles, so don't bother scoring them when the title is already a near-certain
+    # match (the description could only nudge the score up by a few points), or when there's no description at all
+    pending = [i for i in np.flatnonzero(similarities < TITLE_SCORE_CEILING) if videos[i].description]
+    if pending:
+        description_scores = process.cdist([processed_query], [prepare(videos[i].description) for i in pending],
+                                           scorer=fuzz.partial_ratio, dtype=np.uint8, score_cutoff=score_cutoff)[0]
+        similarities[pending] = np.maximum(similarities[pending], description_scores)
+
+    for video, similarity in zip(videos, similarities):
+        if similarity < min_similarity:
+            continue
+
+        yield SearchResult(video=video, query=search_string, similarity=int(similarity))
 
 
 def get_all_results(
-        *query_date_pairs: tuple[str, datetime | None], max_results: int, playlist_id: str | None = None,
-        excluded_ids: set[str] | None = None, ignored_channels: set[str] | None = None
+        query_date_pairs: Iterable[tuple[str, datetime | None]], *, max_results: int, playlist_id: str | None = None,
+        excluded_ids: frozenset[str] | None = None, ignored_channels: set[str] | None = None, min_similarity: int = 0,
+        max_workers: int = 8, cache_expiry: timedelta | None = None
 ) -> list[SearchResult]:
-    client = YouTubeClient()
+    client = YouTubeClient(search_cache_expiry=cache_expiry)
 
     # handle known IDs for filtering
     if not excluded_ids:
-        excluded_ids = set()
+        excluded_ids = frozenset()
 
     if playlist_id:
         excluded_ids |= get_ids_from_playlist(client, playlist_id=playlist_id)
 
     results: dict[str, SearchResult] = {}
 
-    def _should_add(r: SearchResult) -> bool:
-        if r.video.id not in results:
-            # first time we've seen this video
-            return True
+    def _search(query: str, dt: datetime | None) -> list[SearchResult]:
+        return list(search(client, query, max_results, ignore_uploaders=ignored_channels, ignore_ids=excluded_ids,
+                           ignore_before=dt, min_similarity=min_similarity))
+
+    # the searches are network-bound, so run them concurrently and overlap the round trips;
+    # results are merged in submission order, each search's as soon as it finishes
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            futures = [executor.submit(_search, query, dt) for query, dt in query_date_pairs]
+
+            for future in futures:
+                for result in future.result():
+                    # keep only the highest-scoring match for each video, with a single lookup per result
+                    best = results.get(result.video.id)
+                    if best is None or result.similarity > best.similarity:
+                        results[result.video.id] = result
+        except BaseException:
+            # a failed search (exceeded quota, Ctrl-C, ...) should stop the run, not wait for every queued search
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
-        if r.similarity > results[r.video.id].similarity:
-            # we've found the video with a higher similarity score, so we'll replace it with that one
-            return True
+    return list(results.values())
 
-        return False
 
-    for query, dt in query_date_pairs:
-        for result in search(client, query, max_results, ignore_uploaders=ignored_channels, ignore_ids=excluded_ids,
-                             ignore_before=dt):
-            if _should_add(result):
-                results[result.video.id] = result
+def _int_at_least(minimum: int) -> Callable[[str], int]:
+    """An argument type for integers which must be at least the given minimum."""
+    def convert(value: str) -> int:
+        number = int(value)
+        if number < minimum:
+            raise ArgumentTypeError(f"must be at least {minimum}, not {number}")
 
-    return list(results.values())
+        return number
+
+    # argparse names the type in its "invalid ... value" message, so keep that reading "int"
+    convert.__name__ = "int"
+    return convert
 
 
 @argvns
@@ -118,14 +195,41 @@ class Config:
     min_similarity: int = Arg(short="-m", long="--min-similarity", type=int, default=0,
                               help="the minimum similarity for a result to be printed")
     playlist_id: str | None = Arg(long="--playlist-id", help="the id of a playlist whose videos will be ignored")
+    workers: int = Arg(short="-w", long="--workers", type=_int_at_least(1), default=8,
+                       help="the number of searches to run concurrently (default: 8)")
+    cache_hours: int = Arg(long="--cache-hours", type=_int_at_least(0), default=24,
+                           help="how many hours to reuse search results for; 0 disables the cache (default: 24)")
+
+
+def deduplicate_queries(query_date_pairs: Iterable[tuple[str, datetime | None]]) -> dict[str, datetime | None]:
+    """Collapse repeated queries into a single search, keeping the earliest date given for each. A query with no
+    date is not restricted at all, so it counts as the earliest."""
+    queries: dict[str, datetime | None] = {}
+
+    for query, dt in query_date_pairs:
+        queries[query] = min(dt, queries.get(query, dt), key=lambda d: d or datetime.min)
+
+    return queries
 
 
 def read_search_terms_file(filepath: Path) -> Iterator[tuple[str, datetime]]:
     with open(filepath, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+
+        header = next(reader, None)
+        if header is None:
+            # empty file
+            return
+
+        date_index, title_index = header.index("Date"), header.index("Title")
+
         for row in reader:
-            dt = datetime.strptime(row["Date"], "%Y-%m-%d")
-            query = row["Title"]
+            if not row:
+                # blank line
+                continue
+
+            dt = parse_ymd(row[date_index])
+            query = row[title_index]
 
             yield query, dt
 
@@ -133,42 +237,46 @@ def read_search_terms_file(filepath: Path) -> Iterator[tuple[str, datetime]]:
 def main():
     config = Config()
 
-    query_date_pairs: list[tuple[str, datetime | None]] = []
+    query_date_pairs: Iterable[tuple[str, datetime | None]] = ((query, None) for query in config.search_terms)
 
     if config.queries_filepath:
-        query_date_pairs.extend(read_search_terms_file(config.queries_filepath))
-
-    for query in config.search_terms:
-        query_date_pairs.append((query, None))
+        query_date_pairs = chain(read_search_terms_file(config.queries_filepath), query_date_pairs)
 
     if config.exclude_ids.exists():
-        excluded_ids = set(line.strip() for line in config.exclude_ids.read_text(encoding="utf-8").splitlines())
+        with open(config.exclude_ids, "r", encoding="utf-8") as f:
+            excluded_ids = frozenset(map(str.strip, f))
     else:
-        excluded_ids = set()
+        excluded_ids = frozenset()
+
+    queries = deduplicate_queries(query_date_pairs)
 
-    results = get_all_results(*query_date_pairs, playlist_id=config.playlist_id,
+    results = get_all_results(queries.items(), playlist_id=config.playlist_id,
                               excluded_ids=excluded_ids, ignored_channels=set(config.ignored_channels),
-                              max_results=config.max_results)
+                              max_results=config.max_results, min_similarity=config.min_similarity,
+                              max_workers=config.workers,
+                              cache_expiry=timedelta(hours=config.cache_hours))
 
     false_positive_ids = display_and_retrieve_false_positives(results=results, min_similarity=config.min_similarity)
     if false_positive_ids:
         logger.info(f"Appending {len(false_positive_ids)} to {config.exclude_ids.resolve()} as false positives.")
         with open(config.exclude_ids, mode="a+", encoding="utf-8") as f:
-            f.writelines([f"{id_}\n" for id_ in false_positive_ids])
+            f.write("\n".join(false_positive_ids) + "\n")
 
 
 def display_and_retrieve_false_positives(min_similarity: float, results: list[SearchResult]) -> list[str]:
     """Display the search results and allow the user to select results which were false positives.
     These ids can be filtered out on future runs."""
 
-    displayed_results = [r for r in results if r.similarity >= min_similarity]
-    displayed_results.sort(key=lambda r: r.similarity)
+    # filter before sorting, so results that won't be shown aren't sorted
+    displayed_results = sorted((r for r in results if r.similarity >= min_similarity), key=attrgetter("similarity"))
 
-    selected: list[SearchResult] = beaupy.select_multiple(displayed_results,  # type: ignore
-                                                          preprocessor=str,
-                                                          tick_character="[red]❌[/red]")
+    # beaupy re-runs its preprocessor over the visible options on every keypress, so render each row just once here
+    # and map the selection back by index
+    labels = [str(r) for r in displayed_results]
+    selected: list[int] = beaupy.select_multiple(labels, tick_character="[red]❌[/red]",  # type: ignore
+                                                 return_indices=True)
 
-    return [result.video.id for result in selected]
+    return [displayed_results[i].video.id for i in selected]
 
 
 if __name__ == "__main__":
@@ -1,4 +1,3 @@
-import re
 import sys
 import tkinter as tk
 from argparse import Namespace
@@ -148,7 +147,7 @@ class App(ttkb.Window):
         number = self.search_results_number_entry.value
 
         # handle search terms as comma-separated values
-        search_terms = [s for s in re.split(r",\s*", self.search_terms_entry.value) if s]
+        search_terms = [t for t in (s.strip() for s in self.search_terms_entry.value.split(",")) if t]
 
         if self.search_term_file_entry.text:
             file = self.search_term_file_entry.value
@@ -156,7 +155,7 @@ class App(ttkb.Window):
             file = None
 
         # handle ignored uploaders as comma-separated values
-        ignore_uploaders = [s for s in re.split(r",\s*", self.ignore_uploaders_entry.value) if s]
+        ignore_uploaders = [t for t in (s.strip() for s in self.ignore_uploaders_entry.value.split(",")) if t]
 
         # handle known IDs
         known_ids = self.known_ids_entry.value
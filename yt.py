@@ -1,22 +1,46 @@
+import json
+import sqlite3
 import sys
-from collections.abc import Iterator
+import threading
+import time
+from collections.abc import Container, Iterator
 from contextlib import contextmanager
-from dataclasses import dataclass
-from datetime import date, datetime
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+from googleapiclient.model import JsonModel
 from loguru import logger
 
+from dates import parse_ymd
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 SCOPES = ["https://www.googleapis.com/auth/youtube.readonly"]
 
 
-@dataclass
+def _parse_timestamp(s: str) -> datetime:
+    """Parse one of the API's timestamps. These normally look like YYYY-MM-DDThh:mm:ssZ, which is sliced apart
+    directly; anything else (another offset, fractional seconds) goes through strptime, just as parse_ymd does."""
+    if len(s) == 20 and s[10] == "T" and s[19] == "Z":
+        return parse_ymd(s[:10]).replace(hour=int(s[11:13]), minute=int(s[14:16]), second=int(s[17:19]),
+                                         tzinfo=timezone.utc)
+
+    return datetime.strptime(s, "%Y-%m-%dT%H:%M:%S%z")
+
+
+@dataclass(slots=True)
 class VideoData:
     title: str
     description: str
@@ -24,6 +48,11 @@ class VideoData:
     id: str
     uploaded: datetime
     thumbnail: str | None = None
+    uploaded_str: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # formatted once here, since the date is displayed for every result
+        self.uploaded_str = self.uploaded.strftime("%Y-%m-%d")
 
     @property
     def url(self) -> str:
@@ -38,34 +67,128 @@ class VideoData:
             video_id = data["snippet"]["resourceId"]["videoId"]
         except KeyError:
             video_id = data["id"]["videoId"]
-        uploaded = datetime.strptime(data["snippet"]["publishedAt"], "%Y-%m-%dT%H:%M:%S%z")
+        uploaded = _parse_timestamp(data["snippet"]["publishedAt"])
         thumbnail = data["snippet"]["thumbnails"].get("high", {}).get("high", None)
 
         return cls(title=title, description=description, channel=channel, id=video_id, uploaded=uploaded,
                    thumbnail=thumbnail)
 
 
+class _JsonModel(JsonModel):
+    """A JsonModel which parses response bodies with orjson, if it's installed."""
+
+    def deserialize(self, content: bytes | str) -> Any:
+        # both parsers accept bytes directly, so there's no need to decode first
+        try:
+            body = _loads(content)
+        except ValueError:
+            # not JSON, so return the raw body as JsonModel does
+            return content.decode("utf-8") if isinstance(content, bytes) else content
+
+        if self._data_wrapper and "data" in body:
+            body = body["data"]
+
+        return body
+
+
+class _SearchCache:
+    """An on-disk cache of raw search results, keyed by the request parameters, so that repeating a search within
+    the expiry time costs neither a round trip nor any API quota."""
+
+    def __init__(self, path: Path, *, expiry: timedelta):
+        self._expiry = expiry.total_seconds()
+
+        # the connection is shared between the client's worker threads, so all access goes through the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, fetched REAL, items TEXT)")
+            self._db.execute("DELETE FROM searches WHERE fetched < ?", (time.time() - self._expiry,))
+
+    @staticmethod
+    def _key(params: dict[str, Any]) -> str:
+        return json.dumps(params, sort_keys=True)
+
+    def get(self, params: dict[str, Any]) -> list[dict[str, Any]] | None:
+        """Return the cached items for this search, or None if there are none (or they've expired)."""
+        with self._lock:
+            row = self._db.execute("SELECT fetched, items FROM searches WHERE key = ?", (self._key(params),)).fetchone()
+
+        if row is None or time.time() - row[0] > self._expiry:
+            return None
+
+        return _loads(row[1])
+
+    def put(self, params: dict[str, Any], items: list[dict[str, Any]]) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)",
+                             (self._key(params), time.time(), json.dumps(items)))
+
+
 class YouTubeClient:
-    def __init__(self):
-        credentials = self._get_credentials(scopes=SCOPES)
-        self._service = build("youtube", "v3", credentials=credentials)
+    def __init__(self, *, search_cache_expiry: timedelta | None = None):
+        """If search_cache_expiry is given, search results are cached on disk and reused for that long."""
+        self._credentials = self._get_credentials(scopes=SCOPES)
+        self._service = build("youtube", "v3", credentials=self._credentials, model=_JsonModel())
+        self._local = threading.local()
 
-    def search(self, query: str, *, max_results: int = 25, after: date | None = None) -> Iterator[VideoData]:
+        self._search_cache: _SearchCache | None = None
+        if search_cache_expiry:
+            cache_file = Path(__file__).parent.resolve() / "search_cache.sqlite3"
+            self._search_cache = _SearchCache(cache_file, expiry=search_cache_expiry)
+
+    @property
+    def _http(self) -> AuthorizedHttp:
+        """An authorised connection for the current thread. httplib2 is not thread-safe, so requests made from
+        different threads can't share the service's own connection. build_http gives it the same settings as that
+        connection, including the default socket timeout."""
+        if (http := getattr(self._local, "http", None)) is None:
+            http = self._local.http = AuthorizedHttp(self._credentials, http=build_http())
+
+        return http
+
+    def search(self, query: str, *, max_results: int = 25, after: date | None = None,
+               exclude_ids: Container[str] = (), exclude_channels: Container[str] = ()) -> Iterator[VideoData]:
+        """Return an iterator over the videos found by searching for the given query. Videos with ids in exclude_ids
+        or uploaded by channels in exclude_channels are skipped before they're converted to VideoData."""
         kwargs = {"part": "snippet", "q": query, "maxResults": max_results}
         if after:
             kwargs["publishedAfter"] = after.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-        request = self._service.search().list(**kwargs)
-        results = request.execute()
+        items = self._search_cache.get(kwargs) if self._search_cache else None
+        if items is None:
+            request = self._service.search().list(**kwargs)
+            items = request.execute(http=self._http)["items"]
+
+            if self._search_cache:
+                self._search_cache.put(kwargs, items)
+
+        for obj in items:
+            if obj["id"]["kind"] != "youtube#video":
+                continue
 
-        for obj in results["items"]:
-            if obj["id"]["kind"] == "youtube#video":
-                yield VideoData.from_json(data=obj)
+            if obj["id"]["videoId"] in exclude_ids or obj["snippet"]["channelTitle"] in exclude_channels:
+                continue
+
+            yield VideoData.from_json(data=obj)
 
     def videos_in_playlist(self, playlist_id: str) -> Iterator[VideoData]:
         """Return an iterator over the videos in the given playlist."""
+        for obj in self._playlist_items(playlist_id, part="snippet"):
+            yield VideoData.from_json(data=obj)
+
+    def video_ids_in_playlist(self, playlist_id: str) -> Iterator[str]:
+        """Return an iterator over the ids of the videos in the given playlist. Only the ids are requested, so this is
+        much lighter than videos_in_playlist when nothing else is needed."""
+        for obj in self._playlist_items(playlist_id, part="contentDetails",
+                                        fields="nextPageToken,items/contentDetails/videoId"):
+            yield obj["contentDetails"]["videoId"]
+
+    def _playlist_items(self, playlist_id: str, **kwargs: Any) -> Iterator[dict[str, Any]]:
+        """Return an iterator over the raw items in the given playlist, fetching each page as it's needed."""
 
-        kwargs = {"part": "snippet", "playlistId": playlist_id, "maxResults": 50}
+        kwargs.update(playlistId=playlist_id, maxResults=50)
         next_page_token: str | None = None
 
         while True:
@@ -73,10 +196,9 @@ class YouTubeClient:
                 kwargs["pageToken"] = next_page_token
 
             request = self._service.playlistItems().list(**kwargs)
-            results = request.execute()
+            results = request.execute(http=self._http)
 
-            for obj in results["items"]:
-                yield VideoData.from_json(data=obj)
+            yield from results["items"]
 
             if not (next_page_token := results.get("nextPageToken")):
                 return